@@ -1,11 +1,80 @@
+import bisect
 import json
-import math
+import mmap
+import os
+import pickle
+import stat
+import struct
+import sys
+import tempfile
+import threading
+from functools import lru_cache
 from http.server import BaseHTTPRequestHandler
-from statistics import mean
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import orjson as _json
+except ImportError:
+    _json = json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 DATA_FILE = "q-vercel-latency.json"
 
+# Field names tried in priority order
+LATENCY_KEYS = ("latency_ms", "latency", "ms")
+UPTIME_KEYS = (
+    "uptime", "uptime_pct", "uptime_percent", "uptime_percentage",
+    "availability", "availability_pct", "availability_percent",
+    "uptime_ratio", "uptimeRatio", "up",
+)
+
+# Response entry for a region with no records
+EMPTY_REGION = {"avg_latency": 0.0, "p95_latency": 0.0, "avg_uptime": 0.0, "breaches": 0}
+
+# Larger region lists are computed but not memoized, so clients can't pin
+# arbitrarily big keys in the response cache
+MEMO_MAX_REGIONS = 32
+
+# Bump whenever _build_stats() output changes, so sidecars written by older
+# code are rebuilt instead of served
+SIDECAR_VERSION = 1
+
+# Plain-bytes sidecar header: magic, SIDECAR_VERSION, mtime_ns, size.
+# Checked before anything is unpickled.
+_SIDECAR_HEADER = struct.Struct("<4sIqQ")
+_SIDECAR_MAGIC = b"QVLS"
+
+# StatsSnapshot keyed by path.
+# Vercel may reuse a warm process across requests, so keep it module-level.
+_CACHE: Dict[str, Any] = {}
+_CACHE_LOCK = threading.Lock()
+
+# orjson can write numpy scalars itself; stdlib json needs plain int/float
+_NATIVE_NUMPY = hasattr(_json, "OPT_SERIALIZE_NUMPY")
+
+# orjson parses straight from a memoryview; stdlib json needs bytes/str
+_BUFFER_LOADS = _json.__name__ == "orjson"
+
+def loads(raw: Any) -> Any:
+    try:
+        return _json.loads(raw)
+    except json.JSONDecodeError:
+        # orjson rejects NaN, Infinity and out-of-range numbers like 1e400,
+        # all of which stdlib json accepts
+        if _json is json:
+            raise
+        return json.loads(bytes(raw))
+
+def dumps(obj: Any) -> bytes:
+    if _NATIVE_NUMPY:
+        return _json.dumps(obj, option=_json.OPT_SERIALIZE_NUMPY)
+    # stdlib json returns str
+    return _json.dumps(obj).encode("utf-8")
+
 def p95(values):
     """
     95th percentile using linear interpolation (common in numpy/pandas quantile).
@@ -13,23 +82,34 @@ def p95(values):
     if not values:
         return 0.0
 
-    s = sorted(float(v) for v in values)
+    return p95_sorted(sorted(float(v) for v in values))
+
+def p95_sorted(s: List[float]) -> float:
+    """
+    Same as p95(), for values that are already floats in ascending order
+    (a list or a sorted float64 ndarray).
+    """
     n = len(s)
+    if n == 0:
+        return 0.0
     if n == 1:
         return float(s[0])
 
-    # position on 0..n-1
+    # position on 0..n-1; pos >= 0, so int() truncation is the floor
     pos = 0.95 * (n - 1)
-    lo = int(math.floor(pos))
-    hi = int(math.ceil(pos))
+    lo = int(pos)
+    frac = pos - lo
 
-    if lo == hi:
+    if frac == 0.0:
         return float(s[lo])
 
-    frac = pos - lo
-    return float(s[lo] + frac * (s[hi] - s[lo]))
+    return float(s[lo] + frac * (s[lo + 1] - s[lo]))
 
 def to_number(x: Any) -> float:
+    # Floats are the common case; return them without any conversion.
+    # ints still go through float() below since huge ones can overflow.
+    if type(x) is float:
+        return x
     try:
         if isinstance(x, str):
             x = x.strip()
@@ -39,16 +119,16 @@ def to_number(x: Any) -> float:
     except Exception:
         return 0.0
     
-def extract_uptime_percent(r: Dict[str, Any]) -> float:
-    # Try many possible field names
-    candidates = [
-        "uptime", "uptime_pct", "uptime_percent", "uptime_percentage",
-        "availability", "availability_pct", "availability_percent",
-        "uptime_ratio", "uptimeRatio", "up"
-    ]
+def extract_latency(r: Dict[str, Any]) -> float:
+    return to_number(r.get("latency_ms", r.get("latency", r.get("ms", 0))))
 
+def extract_uptime(r: Dict[str, Any]) -> float:
+    """
+    Raw uptime value as stored (percent or ratio), 0.0 if there is none.
+    """
+    # Try many possible field names
     val = None
-    for k in candidates:
+    for k in UPTIME_KEYS:
         if k in r and r.get(k) is not None:
             val = r.get(k)
             break
@@ -56,7 +136,10 @@ def extract_uptime_percent(r: Dict[str, Any]) -> float:
     if val is None:
         return 0.0
 
-    num = to_number(val)
+    return to_number(val)
+
+def extract_uptime_percent(r: Dict[str, Any]) -> float:
+    num = extract_uptime(r)
 
     # If it's a ratio like 0.98373, convert to percent
     # (heuristic: ratios are usually between 0 and 1.5)
@@ -65,6 +148,267 @@ def extract_uptime_percent(r: Dict[str, Any]) -> float:
 
     return float(num)
 
+def region_key(x: Any) -> str:
+    """
+    Case-folded region name used to match records against requested regions.
+    """
+    return x.lower() if isinstance(x, str) else str(x).lower()
+
+def _region_stats(region_records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Everything a request needs for one region that doesn't depend on the
+    threshold, so per-request work is a lookup, a bisect and some arithmetic.
+    """
+    n = len(region_records)
+
+    if np is not None:
+        # One float64 column per field; sort/sum then run in C
+        lat_np = np.fromiter(
+            (extract_latency(r) for r in region_records),
+            dtype=np.float64, count=n,
+        )
+        # Raw values resolve each record's own uptime field, so mixed schemas
+        # are fine; the ratio -> percent heuristic then runs on the whole column
+        up_np = np.fromiter(
+            (extract_uptime(r) for r in region_records),
+            dtype=np.float64, count=n,
+        )
+        up_np = np.where((up_np >= 0) & (up_np <= 1.5), up_np * 100.0, up_np)
+        lat_sorted = np.sort(lat_np)
+        with np.errstate(invalid="ignore"):
+            # inf - inf between neighbours is NaN, as in the list path
+            p95_latency = p95_sorted(lat_sorted)
+        lat_sum = float(lat_np.sum())
+        up_sum = float(up_np.sum())
+
+        # np.sort puts NaN last, where searchsorted would count it as a breach
+        if n and np.isnan(lat_sorted[-1]):
+            lat_sorted = lat_sorted[~np.isnan(lat_sorted)]
+    else:
+        # Single pass: fill latencies in place and accumulate both sums
+        lat_sorted = [0.0] * n
+        lat_sum = up_sum = 0.0
+        for i, r in enumerate(region_records):
+            v = extract_latency(r)
+            lat_sorted[i] = v
+            lat_sum += v
+            up_sum += extract_uptime_percent(r)
+        lat_sorted.sort()
+        p95_latency = p95_sorted(lat_sorted)
+
+        # NaN breaks the ordering bisect relies on, and v > t is never true
+        # for it, so breach counting only sees the other values
+        if lat_sum != lat_sum:
+            lat_sorted = sorted(v for v in lat_sorted if v == v)
+
+    return {
+        "lat_sorted": lat_sorted,
+        "lat_sum": lat_sum,
+        "lat_n": n,
+        "p95": p95_latency,
+        "up_sum": up_sum,
+        "up_n": n,
+    }
+
+def count_above(s: Any, threshold: float) -> Any:
+    """
+    Number of values in ascending, NaN-free s strictly greater than threshold. May be
+    a numpy integer when the JSON backend can serialize it directly.
+    """
+    if np is not None and isinstance(s, np.ndarray):
+        n = len(s) - np.searchsorted(s, threshold, side="right")
+        return n if _NATIVE_NUMPY else int(n)
+    return len(s) - bisect.bisect_right(s, threshold)
+
+class StatsSnapshot:
+    """
+    Region stats built from one version of the telemetry file. Hashes and
+    compares by epoch, the file's (mtime_ns, size), so it can key lru_cache.
+    """
+    __slots__ = ("epoch", "stats")
+
+    def __init__(self, epoch: Tuple[int, int], stats: Dict[str, Dict[str, Any]]) -> None:
+        self.epoch = epoch
+        self.stats = stats
+
+    def __hash__(self) -> int:
+        return hash(self.epoch)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, StatsSnapshot) and other.epoch == self.epoch
+
+def _read_json(path: str) -> Any:
+    """
+    Parse a JSON file, from an mmap of it when the parser takes buffers,
+    so the file isn't first copied into a bytes object.
+    """
+    with open(path, "rb") as f:
+        # mmap can't map an empty file
+        if not _BUFFER_LOADS or os.fstat(f.fileno()).st_size == 0:
+            return loads(f.read())
+
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with memoryview(mm) as buf:
+                return loads(buf)
+        finally:
+            mm.close()
+
+def _build_stats(data: Any) -> Dict[str, Dict[str, Any]]:
+    """
+    Precomputed stats per lowercased region from parsed telemetry JSON.
+    """
+    # Accept either list or {"records":[...]}
+    records = data.get("records", data) if isinstance(data, dict) else data
+    if not isinstance(records, list):
+        records = []
+    # Anything that isn't an object can't carry a region; ignore it
+    records = [r for r in records if isinstance(r, dict)]
+
+    by_region: Dict[str, List[Dict[str, Any]]] = {}
+    for r in records:
+        # Interned once here; the handful of region names live as long as the cache
+        by_region.setdefault(sys.intern(region_key(r.get("region", ""))), []).append(r)
+
+    return {region: _region_stats(rs) for region, rs in by_region.items()}
+
+def _private_tmp_dir(create: bool) -> Optional[str]:
+    """
+    Per-user cache directory under the system temp dir, or None unless it
+    is a real directory owned by us that nobody else can write into.
+    Unpickling runs code, so never trust anything outside it in /tmp.
+    """
+    uid = os.getuid()
+    path = os.path.join(tempfile.gettempdir(), "q-vercel-latency-cache-%d" % uid)
+    if create:
+        try:
+            os.mkdir(path, 0o700)
+        except FileExistsError:
+            pass
+        except OSError:
+            return None
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != uid or st.st_mode & 0o077:
+        return None
+    return path
+
+def _sidecar_name() -> str:
+    return os.path.basename(DATA_FILE) + ".cache.pkl"
+
+def _read_sidecar(key: Tuple[int, int]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Stats pickled by an earlier process with this SIDECAR_VERSION for the
+    same (mtime_ns, size), if any.
+    """
+    paths = [DATA_FILE + ".cache.pkl"]
+    tmp_dir = _private_tmp_dir(create=False)
+    if tmp_dir is not None:
+        paths.append(os.path.join(tmp_dir, _sidecar_name()))
+
+    header = _SIDECAR_HEADER.pack(_SIDECAR_MAGIC, SIDECAR_VERSION, *key)
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                if f.read(_SIDECAR_HEADER.size) != header:
+                    # Other data file version, older code, or not ours
+                    continue
+                return pickle.load(f)
+        except Exception:
+            # Missing, truncated, or pickled with numpy we no longer have
+            continue
+    return None
+
+def _write_sidecar_to(directory: str, blob: bytes) -> bool:
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, os.path.join(directory, _sidecar_name()))
+        return True
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return False
+
+def _write_sidecar(key: Tuple[int, int], stats: Dict[str, Dict[str, Any]]) -> None:
+    blob = _SIDECAR_HEADER.pack(_SIDECAR_MAGIC, SIDECAR_VERSION, *key) + pickle.dumps(stats, protocol=5)
+
+    # Next to the data file; only where that's read-only, our private /tmp dir
+    try:
+        if _write_sidecar_to(os.path.dirname(DATA_FILE) or ".", blob):
+            return
+    except OSError:
+        pass
+
+    tmp_dir = _private_tmp_dir(create=True)
+    if tmp_dir is None:
+        return
+    try:
+        _write_sidecar_to(tmp_dir, blob)
+    except OSError:
+        pass
+
+def _load_stats() -> StatsSnapshot:
+    """
+    Precomputed stats per lowercased region, rebuilt only when the telemetry
+    file changes on disk. A pickle sidecar carries them across cold starts.
+    """
+    st = os.stat(DATA_FILE)
+    key = (st.st_mtime_ns, st.st_size)
+    snap = _CACHE.get(DATA_FILE)
+    if snap and snap.epoch == key:
+        return snap
+
+    with _CACHE_LOCK:
+        snap = _CACHE.get(DATA_FILE)
+        if snap and snap.epoch == key:
+            return snap
+
+        stats = _read_sidecar(key)
+        if stats is None:
+            stats = _build_stats(_read_json(DATA_FILE))
+            _write_sidecar(key, stats)
+
+        snap = StatsSnapshot(key, stats)
+        _CACHE[DATA_FILE] = snap
+        # Memoized responses for older epochs can never be hit again
+        _compute_payload_bytes.cache_clear()
+        return snap
+
+@lru_cache(maxsize=256)
+def _compute_payload_bytes(regions_key: Tuple[str, ...], threshold_ms: float, snap: StatsSnapshot) -> bytes:
+    """
+    Encoded response body for a request, computed from exactly the stats
+    snapshot passed in. The snapshot keys the memo by its epoch, so a
+    changed telemetry file never serves stale responses.
+    """
+    stats = snap.stats
+
+    # Build array of per-region stats (the checker likes array or object under k.regions)
+    regions_out = []
+
+    for name in regions_key:
+        st = stats.get(region_key(name))
+
+        if not st or not st["lat_n"]:
+            regions_out.append({"region": name, **EMPTY_REGION})
+            continue
+
+        regions_out.append({
+            "region": name,
+            "avg_latency": st["lat_sum"] / st["lat_n"],
+            "p95_latency": st["p95"],
+            "avg_uptime": st["up_sum"] / st["up_n"],
+            "breaches": count_above(st["lat_sorted"], threshold_ms),
+        })
+
+    return dumps({"regions": regions_out})
+
 class handler(BaseHTTPRequestHandler):
     def _set_cors(self) -> None:
         # Must be exactly "*" for the checker
@@ -74,6 +418,15 @@ class handler(BaseHTTPRequestHandler):
         self.send_header("Access-Control-Allow-Methods", "POST, GET, OPTIONS")
         self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
 
+    def _send_json(self, status: int, body: bytes) -> None:
+        # Known length up front lets the client finish reading without waiting on close
+        self.send_response(status)
+        self._set_cors()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_OPTIONS(self):
         self.send_response(200)
         self._set_cors()
@@ -82,62 +435,36 @@ class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         # Read request JSON
         length = int(self.headers.get("Content-Length", 0))
-        raw = self.rfile.read(length).decode("utf-8") if length else ""
+        raw = self.rfile.read(length) if length else b""
         try:
-            body = json.loads(raw) if raw else {}
+            body = loads(raw) if raw else {}
         except Exception:
             body = {}
 
+        if not isinstance(body, dict):
+            self._send_json(400, dumps({"error": "Request body must be a JSON object"}))
+            return
+
         regions = body.get("regions", [])
+        if not isinstance(regions, list):
+            self._send_json(400, dumps({"error": "regions must be a list"}))
+            return
         threshold_ms = to_number(body.get("threshold_ms", 180))
 
+        # Region names are echoed back as given, so they key the memo as-is
+        regions_key = tuple(str(r) for r in regions)
+
         # Load telemetry JSON
         try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            snap = _load_stats()
         except Exception as e:
-            self.send_response(500)
-            self._set_cors()
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({"error": "Failed to load data file", "detail": str(e)}).encode("utf-8"))
+            self._send_json(500, dumps({"error": "Failed to load data file", "detail": str(e)}))
             return
 
-        # Accept either list or {"records":[...]}
-        records = data.get("records", data) if isinstance(data, dict) else data
-        if not isinstance(records, list):
-            records = []
-
-        # Build array of per-region stats (the checker likes array or object under k.regions)
-        regions_out = []
-
-        for region in regions:
-            region_records = [r for r in records if str(r.get("region", "")).lower() == str(region).lower()]
-
-            latencies = [
-                to_number(r.get("latency_ms", r.get("latency", r.get("ms", 0))))
-                for r in region_records
-            ]
-            uptimes = [extract_uptime_percent(r) for r in region_records]
-
-            avg_latency = float(mean(latencies)) if latencies else 0.0
-            p95_latency = p95(latencies)
-            avg_uptime = float(mean(uptimes)) if uptimes else 0.0
-            breaches = sum(1 for v in latencies if v > threshold_ms)
-
-            regions_out.append({
-                "region": str(region),
-                "avg_latency": avg_latency,
-                "p95_latency": p95_latency,
-                "avg_uptime": avg_uptime,
-                "breaches": breaches,
-            })
+        if len(regions_key) <= MEMO_MAX_REGIONS:
+            body_bytes = _compute_payload_bytes(regions_key, threshold_ms, snap)
+        else:
+            body_bytes = _compute_payload_bytes.__wrapped__(regions_key, threshold_ms, snap)
 
         # Send response with CORS header on the POST response
-        self.send_response(200)
-        self._set_cors()
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-
-        payload = {"regions": regions_out}
-        self.wfile.write(json.dumps(payload).encode("utf-8"))
\ No newline at end of file
+        self._send_json(200, body_bytes)